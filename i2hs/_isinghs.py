@@ -1,11 +1,12 @@
-import time
+import sys, time
 from datetime import timedelta
-import tempfile, subprocess, os, heapq
+import tempfile, subprocess, os
+import numpy as np
+from numba import njit
 from amplify import (
     VariableGenerator,
     greater_equal,
-    PolyArray,
-    AcceptableDegrees,
+    ConstraintList,
     Model,
     GurobiClient,
     FixstarsClient,
@@ -13,6 +14,164 @@ from amplify import (
     solve
 )
 
+def _grow(a, size):
+    """
+    Auxiliary function to enlarge an array to at least the given size by (at least) doubling its capacity.
+
+    Parameters:
+    a (numpy.ndarray): The array to be enlarged.
+    size (int): The minimum size of the new array.
+
+    Returns:
+    numpy.ndarray: A new array starting with the content of a.
+    """
+    b = np.empty(max(2 * len(a), size), dtype=a.dtype)
+    b[:len(a)] = a
+    return b
+
+@njit(cache=True, nogil=True)
+def _hs_simple_kernel(n, indptr, indices):
+    """
+    Greedy hitting set kernel: Repeatedly pick a vertex of maximum degree and remove the edges it hits.
+
+    The vertices are kept in a bucket queue indexed by their current degree, where every
+    bucket is a doubly linked list (head, succ, pred) to allow constant time updates.
+
+    Parameters:
+    n (int): The number of vertices.
+    indptr, indices (numpy.ndarray): The edges in CSR layout.
+
+    Returns:
+    numpy.ndarray: The selected vertices.
+    """
+    m = len(indptr) - 1
+
+    # reverse CSR layout: for every vertex the edges containing it (counting sort)
+    degree = np.zeros(n, dtype=np.int32)
+    for k in range(indptr[m]):
+        degree[indices[k]] += 1
+    vindptr = np.zeros(n + 1, dtype=np.int64)
+    for v in range(n):
+        vindptr[v+1] = vindptr[v] + degree[v]
+    vindices = np.empty(indptr[m], dtype=np.int32)
+    fill     = vindptr[:-1].copy()
+    for i in range(m):
+        for k in range(indptr[i], indptr[i+1]):
+            vindices[fill[indices[k]]] = i
+            fill[indices[k]] += 1
+
+    # bucket queue
+    top    = degree.max() if n > 0 else 0
+    head   = np.full(top + 1, -1, dtype=np.int32)
+    succ   = np.full(n, -1, dtype=np.int32)
+    pred   = np.full(n, -1, dtype=np.int32)
+    for v in range(n):
+        if degree[v] > 0:
+            succ[v] = head[degree[v]]
+            if head[degree[v]] >= 0:
+                pred[head[degree[v]]] = v
+            head[degree[v]] = v
+
+    result = np.empty(n, dtype=np.int64)
+    size   = 0
+    hit    = np.zeros(m, dtype=np.bool_)
+    while top > 0:
+        v = head[top]
+        if v < 0:
+            top -= 1
+            continue
+        result[size] = v
+        size += 1
+        for j in range(vindptr[v], vindptr[v+1]):
+            i = vindices[j]
+            if hit[i]:
+                continue
+            hit[i] = True
+            for k in range(indptr[i], indptr[i+1]):
+                w = indices[k]
+                # unlink w from its bucket
+                if pred[w] >= 0:
+                    succ[pred[w]] = succ[w]
+                else:
+                    head[degree[w]] = succ[w]
+                if succ[w] >= 0:
+                    pred[succ[w]] = pred[w]
+                # and link it into the next lower one (vertices without edges are dropped)
+                degree[w] -= 1
+                pred[w] = -1
+                succ[w] = -1
+                if degree[w] > 0:
+                    succ[w] = head[degree[w]]
+                    if head[degree[w]] >= 0:
+                        pred[head[degree[w]]] = w
+                    head[degree[w]] = w
+    return result[:size]
+
+def _to_bits(n, vertices):
+    """
+    Auxiliary function to represent a set of vertices {0...n-1} as bitset.
+
+    Parameters:
+    n (int): The number of vertices.
+    vertices (list of int): The vertices in the set.
+
+    Returns:
+    numpy.ndarray: The bitset as array of ceil(n/64) words of type uint64.
+    """
+    bits     = np.zeros((n + 63) // 64, dtype=np.uint64)
+    vertices = np.asarray(vertices, dtype=np.uint64)
+    np.bitwise_or.at(bits, vertices >> np.uint64(6), np.uint64(1) << (vertices & np.uint64(63)))
+    return bits
+
+@njit(cache=True, nogil=True)
+def _unhit_kernel(indptr, indices, bits):
+    """
+    Kernel to test which edges are not hit by a set of vertices. An edge is only scanned up to its first
+    vertex in the set.
+
+    Parameters:
+    indptr, indices (numpy.ndarray): The edges in CSR layout.
+    bits (numpy.ndarray): The set of vertices as bitset (see _to_bits).
+
+    Returns:
+    numpy.ndarray: Boolean mask of the edges that contain no vertex of the set.
+    """
+    m     = len(indptr) - 1
+    unhit = np.ones(m, dtype=np.bool_)
+    for i in range(m):
+        for k in range(indptr[i], indptr[i+1]):
+            v = indices[k]
+            if (bits[v >> 6] >> np.uint64(v & 63)) & np.uint64(1):
+                unhit[i] = False
+                break
+    return unhit
+
+class _EdgeView:
+    """
+    Read-only view on the edges of a hypergraph that are stored in CSR layout.
+    Supports len(), indexing and iteration, the edges are returned as lists of int.
+    """
+    __slots__ = 'hypergraph',
+
+    def __init__(self, hypergraph):
+        self.hypergraph = hypergraph
+
+    def __len__(self):
+        return self.hypergraph.m
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("edge index out of range")
+        indptr = self.hypergraph.indptr
+        return self.hypergraph.indices[indptr[i]:indptr[i+1]].tolist()
+
+    def __iter__(self):
+        indptr, indices = self.hypergraph.indptr.tolist(), self.hypergraph.indices.tolist()
+        for i in range(len(self)):
+            yield indices[indptr[i]:indptr[i+1]]
+
 class Hypergraph:
     """
     A hypergraph (set system) that supports to compute hitting sets (subsets of the universe that intersect all sets in the system)
@@ -20,8 +179,11 @@ class Hypergraph:
 
     Attributes:
     n (int): The number of vertices {0...n-1}.
-    edges (list of list of int): The edges (or sets) in the hypergraph (set system).
-    weights (list of floats): The weights of the vertices.
+    m (int): The number of edges.
+    edges (list-like of list of int): Read-only view on the edges (or sets) in the hypergraph (set system).
+    indptr (numpy.ndarray): Offsets of the edges in indices (CSR layout of the edges).
+    indices (numpy.ndarray): The concatenated vertices of all edges (CSR layout of the edges).
+    weights (numpy.ndarray): The weights of the vertices (float64), to be changed with set_weight(s) and add_to_weight.
     config (dictionary): The configuration of the solver.
     ipucalls (int): Accumulated number of calls to the IPU.
     encodingtime: Accumulated time to produce QUBO encodings.
@@ -29,18 +191,22 @@ class Hypergraph:
 
     Methods:
     add_edge(list of int):
-      Adds the given edge to the set system.
+      Adds the given edge to the set system (unless it is redundant).
     set_weight(int, float):
       Sets the weight of a vertex
+    set_weights(array of float):
+      Sets the weights of all vertices at once.
     add_to_weight(v, float):
       Adds the given weight to the current weight of a vertex.
     get_weight(int):
       Returns the weight of the given vertex.
+    encode_edges():
+      Encodes the constraints of new edges ahead of the next call to the IPU.
     compute_hs(bool):
       Computes a hitting set of the graph. If the flag is set to True, a simple heuristic is used,
       otherwise the IPU is used.       
     """    
-    __slots__ = 'n', 'edges', 'weights', 'config', 'ipucalls', 'encodingtime', 'annealingtime'
+    __slots__ = 'n', 'm', 'edges', '_indptr', '_indices', 'weights', 'config', 'ipucalls', 'encodingtime', 'annealingtime', '_abs_weight_sum', '_q', '_constraints'
     
     def __init__(self, n, config):
         """
@@ -51,21 +217,96 @@ class Hypergraph:
         config: Dictionary with the solver configuration.
         """
         self.n             = n
-        self.edges         = []
-        self.weights       = [0] * n
+        self.m             = 0
+        self.edges         = _EdgeView(self)
+        self._indptr       = np.zeros(16, dtype=np.int64)
+        self._indices      = np.empty(64, dtype=np.int32)
+        self.weights       = np.zeros(n, dtype=np.float64)
         self.config        = config
         self.ipucalls      = 0
         self.encodingtime  = 0
         self.annealingtime = 0
+        self._abs_weight_sum = 0.0
+        self._q            = None
+        self._constraints  = None
 
     def add_edge(self, e):
         """
         Add an edge to the hypergraph.
 
+        An edge that contains an existing edge is redundant, as every hitting set of the existing edge
+        hits it as well, and is not added. Vice versa, existing edges that contain the new edge are removed.
+
         Parameters:
         e (list of int): A list of integers representing the vertices of the edge.
+
+        Returns:
+        bool: True if the edge was added, False if it was redundant.
+        """
+        count = self._count_shared(e)
+        if np.any(count == np.diff(self.indptr)):
+            return False
+        if np.any(count == len(e)):
+            self._remove_edges(count == len(e))
+
+        start, end = self._indptr[self.m], self._indptr[self.m] + len(e)
+        if self.m + 2 > len(self._indptr):
+            self._indptr = _grow(self._indptr, self.m + 2)
+        if end > len(self._indices):
+            self._indices = _grow(self._indices, end)
+        self._indices[start:end] = e
+        self._indptr[self.m+1]   = end
+        self.m += 1
+        return True
+
+    def _remove_edges(self, remove):
+        """
+        Auxiliary method to remove edges, the remaining edges keep their order.
+
+        Parameters:
+        remove (numpy.ndarray): Boolean mask of the edges to be removed.
+        """
+        keep  = np.flatnonzero(~remove)
+        sizes = np.diff(self.indptr)
+        self._indices = self.indices[np.repeat(~remove, sizes)]
+        self._indptr  = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(sizes[keep], out=self._indptr[1:])
+        self.m = len(keep)
+
+        # select the cached constraints of the kept edges
+        if self._constraints is not None:
+            encoded = len(self._constraints)
+            self._constraints = ConstraintList([self._constraints[i] for i in keep if i < encoded])
+
+    def _count_shared(self, vertices):
+        """
+        Auxiliary method to count for every edge how many of the given vertices it contains.
+
+        Parameters:
+        vertices (list of int): The vertices (duplicates are ignored).
+
+        Returns:
+        numpy.ndarray: For every edge the number of contained vertices.
+        """
+        member = np.zeros(self.n, dtype=np.int64)
+        member[np.asarray(vertices, dtype=np.int64)] = 1
+        prefix = np.zeros(len(self.indices) + 1, dtype=np.int64)
+        np.cumsum(member[self.indices], out=prefix[1:])
+        return prefix[self.indptr[1:]] - prefix[self.indptr[:-1]]
+
+    @property
+    def indptr(self):
+        """
+        The offsets of the edges in indices, i.e., edge i is indices[indptr[i]:indptr[i+1]].
+        """
+        return self._indptr[:self.m+1]
+
+    @property
+    def indices(self):
+        """
+        The concatenated vertices of all edges.
         """
-        self.edges.append(e)
+        return self._indices[:self._indptr[self.m]]
 
     def set_weight(self, v, w):
         """
@@ -75,7 +316,18 @@ class Hypergraph:
         v (int): The vertex whose weight is to be set.
         w (float): The weight to be assigned to the vertex.
         """
-        self.weights[v] = w
+        self._abs_weight_sum += abs(w) - abs(self.weights[v])
+        self.weights[v]       = w
+
+    def set_weights(self, weights):
+        """
+        Set the weights of all vertices at once.
+
+        Parameters:
+        weights (array-like of float): The weights, indexed by the vertices.
+        """
+        self.weights[:]      = weights
+        self._abs_weight_sum = float(np.abs(self.weights).sum())
 
     def add_to_weight(self, v, w):
         """
@@ -85,7 +337,8 @@ class Hypergraph:
         v (int): The vertex whose weight is to be updated.
         w (float): The amount to add to the vertex's current weight.
         """
-        self.weights[v] += w
+        self._abs_weight_sum += abs(self.weights[v] + w) - abs(self.weights[v])
+        self.weights[v]      += w
 
     def get_weight(self, v):
         """
@@ -97,7 +350,7 @@ class Hypergraph:
         Returns:
         float: The weight of the vertex.
         """
-        return self.weights[v]
+        return float(self.weights[v])
     
     def compute_hs(self, heuristic = False):
         """
@@ -111,103 +364,119 @@ class Hypergraph:
         if heuristic:
             return self._hs_simple()
         
-        # end of recursion
-        if len(self.edges) == 0:
-            return []
-        
-        # compute a hitting set using the Ising machine
-        self.ipucalls += 1
-        model, mapping = self._create_model()
-        result = self._solve_model(model, mapping)
-
-        # ensure to select at least one vertex
-        if len(result) == 0:
-            result.append( self.edges[0][0] )
-                    
-        # repair it if necessary
-        unhit = []
-        for e in self.edges:
-            if not any(v in e for v in result):
-                unhit.append(e)
-        if len(unhit) > 0:
-            h = Hypergraph(self.n, self.config)
-            for e in unhit:
-                h.add_edge(e)
-            for v in h.compute_hs():
-                result.append(v)
+        # vertices of edges of size one are in every hitting set and are not passed to the Ising machine
+        result = self.indices[self.indptr[:-1][np.diff(self.indptr) == 1]].tolist()
+
+        # compute a hitting set using the Ising machine and repair it, if necessary,
+        # by solving the subproblem of the edges that are not hit yet
+        unhit  = self._unhit_edges(result)
+        while len(unhit) > 0:
+            self.ipucalls += 1
+            model = self._create_model(unhit)
+            selection = self._solve_model(model)
+
+            # ensure to select at least one vertex
+            if len(selection) == 0:
+                selection.append( self.edges[unhit[0]][0] )
+            result.extend(selection)
+            unhit = self._unhit_edges(result)
         # done
         return result
 
+    def _unhit_edges(self, vertices):
+        """
+        Auxiliary method to find the edges that are not hit by the given vertices.
+
+        Parameters:
+        vertices (list of int): The selected vertices.
+
+        Returns:
+        numpy.ndarray: The indices of the edges that contain none of the vertices.
+        """
+        return np.flatnonzero(_unhit_kernel(self.indptr, self.indices, _to_bits(self.n, vertices)))
+
     def _hs_simple(self):
         """
         Simple heuristic to compute a hitting: Just pick the vertex that is contained
         in the most edges and remove it together with all edges it hits.
+
+        The work is done by a compiled kernel on the CSR layout of the edges.
         """
-        result = []
-        watch = {}
-        for v in range(self.n):
-            watch[v] = set()
-        for (i,e) in enumerate(self.edges):
-            for v in e:
-                watch[v].add(i)
-                
-        queue = []
-        for v in range(self.n):
-            heapq.heappush(queue, (-len(watch[v]), v))
+        return _hs_simple_kernel(self.n, self.indptr, self.indices).tolist()
 
-        while len(queue) > 0:
-            (deg, v) = heapq.heappop(queue)
-            if -deg != len(watch[v]):
-                continue
-            if deg == 0:
-                break
-            result.append(v)
-            for i in watch[v].copy():
-                for w in self.edges[i]:
-                    watch[w].remove(i)
-                    heapq.heappush(queue, (-len(watch[w]), w))
-        return result
-            
-    
-    def _create_model(self):
+    def encode_edges(self):
+        """
+        Encodes the constraints of the edges that are not encoded yet and adds them to the cache
+        of constraints, from which the QUBO models are built.
+
+        This is done implicitly when a model is created, but can be done ahead of time (for instance,
+        concurrently to the SAT solver). This function also measures the time spent encoding.
+        """
+        tstart = time.time()
+
+        # the variables and the constraints of already encoded edges are cached
+        if self._q is None:
+            gen               = VariableGenerator()
+            self._q           = gen.array("Binary", self.n)
+            self._constraints = ConstraintList()
+        q = self._q
+
+        # at least one constraint for every edge that is not encoded yet: edges of the same
+        # size are stacked into an index matrix, which is encoded row-wise with a single call
+        start   = self.indptr[len(self._constraints)]
+        indptr  = self.indptr[len(self._constraints):] - start
+        indices = self.indices[start:]
+        sizes   = np.diff(indptr)
+        groups  = []
+        for s in np.unique(sizes):
+            rows = np.flatnonzero(sizes == s)
+            cols = indices[indptr[rows, None] + np.arange(s)]
+            groups.append( (rows, greater_equal(q.take(cols.ravel().tolist()).reshape(len(rows), int(s)), 1, axis=1)) )
+
+        # append the constraints in the order of the edges, a single group already is in this order
+        if len(groups) == 1:
+            self._constraints += groups[0][1]
+        elif len(groups) > 1:
+            batch = [None] * len(sizes)
+            for (rows, group) in groups:
+                for (i, c) in zip(rows, group):
+                    batch[i] = c
+            self._constraints.extend(batch)
+
+        # done
+        self.encodingtime += (time.time() - tstart)
+
+    def _create_model(self, edges = None):
         """
         Auxiliary method to create a QUBO model for the hitting set problem.
 
+        Parameters:
+        edges (list of int): The indices of the edges to be hit (default: all edges).
         
         This function also measures the time spent building the model.
         """
+        self.encode_edges()
         tstart = time.time()
-        rho = sum(map(lambda x: abs(x), self.weights)) + 1
+        rho = float(self._abs_weight_sum) + 1
 
         # objective: minimize the sum of weigts of selected variables
-        gen = VariableGenerator()
-        q   = gen.array("Binary", self.n)
-        obj = self.weights * q
-        
-        # at least one constraint for every edge
-        constraints = None
-        for e in self.edges:            
-            c = greater_equal(PolyArray(list(map(lambda v: q[v], e))).sum(), 1)
-            c.weight = rho
-            if constraints is None:
-                constraints = c
-            else:
-                constraints += c
+        obj = self.weights @ self._q
 
-        # build a model with the objective and the constraints
-        model = Model(obj.sum())
-        if constraints is not None:
-            model.constraints = constraints
+        # the cache is in the order of the edges, so a subset is just a selection
+        constraints = self._constraints
+        if edges is not None and len(edges) < self.m:
+            constraints = ConstraintList([constraints[i] for i in edges])
 
-        # transform it into an unconstrainted problem
-        bq = AcceptableDegrees(objective={"Binary": "Quadratic"})
-        imodel, mapping = model.to_intermediate_model(bq)
+        # build a model with the objective and the constraints
+        model = Model(obj)
+        if len(constraints) > 0:
+            model.constraints = rho * constraints
 
-        # done
+        # done, solve transforms the model into the form accepted by the client
         self.encodingtime += (time.time() - tstart)
-        return imodel, mapping
+        return model
 
-    def _solve_model(self, model, mapping):
+    def _solve_model(self, model):
         """
         Auxiliary method to solve a QUBO model using the Fixstars Amplify cloud.
         Supported are the Amplify Engine or Gurobi.
@@ -217,24 +486,22 @@ class Hypergraph:
         tstart = time.time()
         print("c Calling the IPU ...", end = "", flush = True)
         if self.config['settings']['mode'] == "fixstars":
-            result = self._solve_with_fixstars(model, mapping)
+            result = self._solve_with_fixstars(model)
         elif self.config['settings']['mode'] == "dwave":
-            result = self._solve_with_dwave(model, mapping)
+            result = self._solve_with_dwave(model)
         elif self.config['settings']['mode'] == "gurobi":
-            result = self._solve_with_gurobi(model, mapping)
+            result = self._solve_with_gurobi(model)
         else:
             print("c Error: Unknown mode specified.")
             sys.exit(1)
         print(f" {(time.time()-tstart):06.2f}s.")
         self.annealingtime += (time.time() - tstart)            
             
-        result = result.best.values
-        return list(map(
-            lambda vq: vq[0],
-            filter(lambda vq: vq[0] < self.n and result[vq[1]] > 0.0001, enumerate(result))
-        ))
+        # values of the vertex variables (auxiliary variables of the encoding are ignored)
+        values = self._q.evaluate(result.best.values, 0.0)
+        return np.flatnonzero(values > 0.0001).tolist()
 
-    def _solve_with_gurobi(self, model, mapping):
+    def _solve_with_gurobi(self, model):
         """
         Auxiliary method that solves the QUBO model using Gurobi.
         The Gurobi library path must be set in the configuration file in order to use this method.
@@ -244,7 +511,7 @@ class Hypergraph:
         client.parameters.output_flag = 0
         return solve(model, client)
 
-    def _solve_with_fixstars(self, model, mapping):
+    def _solve_with_fixstars(self, model):
         """
         Auxiliary method that solves the QUBO model using the Fixstars Amplify Engine.
         The Fixstars Amplify token must be set in the configuration file in order to use this method.        
@@ -255,7 +522,7 @@ class Hypergraph:
         client.parameters.num_gpus = 1
         return solve(model, client)
 
-    def _solve_with_dwave(self, model, mapping):
+    def _solve_with_dwave(self, model):
         """
         Auxiliary method that solves the QUBO model using the D-Wave Leap hybrid algorithm.
         The D-Wave token must be set in the configuration file in order to use this method.
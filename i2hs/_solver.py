@@ -1,4 +1,6 @@
 import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from i2hs import Hypergraph, BiMap
 from pysat.solvers import Solver as SATSolver
 
@@ -12,12 +14,13 @@ class Solver:
     hypergraph (i2hs.Hypergraph): A representation of the extracted cores.
     mapping (i2h.BiMap): Mapping between relaxation variables and hypergraph vertices.
     sattime (float): Accumulated time spend in the SAT solver.
+    config (dictionary): The configuration of the solver.
 
     Methods:
     run():
       Executes the solver and returns an assignment.
     """
-    __slots__ = 'phi', 'relaxation', 'hypergraph', 'mapping', 'sattime'
+    __slots__ = 'phi', 'relaxation', 'hypergraph', 'mapping', 'sattime', 'config', '_relaxation_arr', '_total_weight', '_assumed', '_unassumed', '_satisfiable'
     
     def __init__(self, phi, relaxation, config):
         """
@@ -33,72 +36,161 @@ class Solver:
         self.hypergraph = Hypergraph(len(relaxation), config)
         self.mapping    = BiMap()
         self.sattime    = 0
-        for (i,(v,weight)) in enumerate(relaxation):
-            self.mapping.insert(v,i)
-            self.hypergraph.set_weight(i, weight)
+        self.config     = config
+        weights              = np.fromiter((w for (_,w) in relaxation), dtype=np.float64, count=len(relaxation))
+        self._relaxation_arr = np.fromiter((v for (v,_) in relaxation), dtype=np.int64, count=len(relaxation))
+        self._total_weight   = float(weights.sum())
+        self._assumed        = np.ones(len(relaxation), dtype=bool)
+        self._unassumed      = []
+        self._satisfiable    = None
+        self.hypergraph.set_weights(weights)
+        insert = self.mapping.insert
+        for (i,v) in enumerate(self._relaxation_arr.tolist()):
+            insert(v,i)
 
-    def _run_satsolver(self, satsolver, assumption):
+    def _run_satsolver(self, satsolver, assumed):
         """
         Auxiliary method to run the SAT solver under the given assumption and measure the time.
+        The SAT solver is run such that it releases the GIL, so other threads may work meanwhile.
+
+        If the previous call was satisfiable under a superset of the assumption, the model of that call
+        satisfies the formula under the assumption as well and the SAT solver is not called again.
 
         Parameters:
         satsolver: The PySAT SAT solver.
-        assumptions: List of literals to be assumed.
+        assumed (numpy.ndarray): Boolean mask of the relaxation variables that are assumed to be true.
         """
+        if self._satisfiable is not None and not (assumed & ~self._satisfiable).any():
+            return True
         tstart        = time.time()
-        satresult     = satsolver.solve( assumptions = assumption )
+        satresult     = satsolver.solve_limited( assumptions = self._relaxation_arr[assumed].tolist(), expect_interrupt = True )
         self.sattime += (time.time() - tstart)
+        self._satisfiable = assumed.copy() if satresult else None
         return satresult
 
     def _extract_core(self, satsolver):
+        """
+        Auxiliary method to add the core of the last (unsatisfiable) SAT call as edge to the hypergraph.
+
+        Parameters:
+        satsolver: The PySAT SAT solver.
+
+        Returns:
+        False if there is no core to be hit, i.e., there is none or it is empty (and the hard clauses
+        are unsatisfiable), and True otherwise.
+        """
         core = satsolver.get_core()
-        if core is None:
-            False
-        self.hypergraph.add_edge(
-            list(map(lambda v:self.mapping.get_value(v), core))
-        )
+        if not core:
+            return False
+        vertex = self.mapping.key_to_value
+        self.hypergraph.add_edge( [vertex[v] for v in core] )
         return True
 
-        
+    def _assumption(self, hittingset):
+        """
+        Auxiliary method to compute the assumption for a hitting set: All relaxation variables that
+        are not in the hitting set are assumed to be true.
+
+        The mask is a buffer that is reused by the next call, which only resets the entries of the
+        previous hitting set.
+
+        Parameters:
+        hittingset: List of the hypergraph vertices in the hitting set.
+
+        Returns:
+        numpy.ndarray: Boolean mask of the assumed relaxation variables (indexed like the vertices).
+        """
+        assumed = self._assumed
+        assumed[self._unassumed] = True
+        assumed[hittingset]      = False
+        self._unassumed          = hittingset
+        return assumed
+
+    def _repair_hittingset(self, satsolver, hittingset):
+        """
+        Auxiliary method for the fast path after a core was found for the hitting set of the IPU:
+        Instead of calling the IPU again, the hitting set is repaired with the cheapest vertex of
+        the new core and the SAT solver is called again. This is repeated for the configured number
+        of rounds (config['solver']['core_repairs'], default 0).
+
+        Parameters:
+        satsolver: The PySAT SAT solver.
+        hittingset: List of the hypergraph vertices in the hitting set, which is extended in place.
+
+        Returns:
+        True if the search is finished, i.e., the formula is satisfiable under the repaired hitting set
+        or there is no core to be hit anymore.
+        """
+        get_value, get_weight = self.mapping.get_value, self.hypergraph.get_weight
+        for _ in range(self.config.get('solver', {}).get('core_repairs', 0)):
+            core = [get_value(v) for v in satsolver.get_core()]
+            if len(core) == 0:
+                return True
+            hittingset.append( min(core, key = get_weight) )
+            if self._run_satsolver(satsolver, self._assumption(hittingset)):
+                return True
+            if not self._extract_core(satsolver):
+                return True
+        return False
+
     def run(self):
         """
         Executes the implicit Ising hitting set algorithm to find a solution for the MaxSAT instance.
         """
-        relaxation_vars = set(map(lambda v: v[0], self.relaxation))
-        satsolver = SATSolver(name='g3', bootstrap_with = self.phi.clauses )
+        engine    = self.config.get('solver', {}).get('sat_engine', 'g3')
+        satsolver = SATSolver(name=engine, bootstrap_with = self.phi.clauses, use_timer = False )
+        self._satisfiable = None
+        compute_hs, encode_edges = self.hypergraph.compute_hs, self.hypergraph.encode_edges
+        run_satsolver, assumption = self._run_satsolver, self._assumption
         
-        while True:
-            # The outer loop computes hitting sets with a heuristic.
-            hittingset = set( map(lambda v: self.mapping.get_key(v), self.hypergraph.compute_hs(heuristic=True)) )
-            assumption = relaxation_vars.difference(hittingset)
-            if self._run_satsolver(satsolver, assumption):
-                # If the formula is satisfiable under the assumption computed with the heuristic,
-                # we compute hitting sets with the IPU.
-                hittingset = set( map(lambda v: self.mapping.get_key(v), self.hypergraph.compute_hs()) )
-                assumption = relaxation_vars.difference(hittingset)                
-                if self._run_satsolver(satsolver, assumption):
-                    # The formula is also satisfiable under the assumptions computed with the IPU.
-                    # This is the best solution we can hope for and, hence, we terminate.
-                    # Note that we do *not* have necessarily reached an optimum unless we use an exact IPU.
-                    break
-                elif not self._extract_core(satsolver):
-                    break                                                
-            elif not self._extract_core(satsolver):
-                break
+        # If the heuristic hitting set was feasible for some iterations in a row (i.e., only the IPU
+        # found new cores), the heuristic is skipped for equally many iterations.
+        patience = self.config.get('solver', {}).get('heuristic_patience', 0)
+        streak, skip = 0, 0
+
+        # While the heuristic hitting set is computed and checked by the SAT solver, a worker encodes
+        # the new edges of the hypergraph for the next call of the IPU. Both only read the edges and
+        # the heuristic as well as the SAT solver release the GIL.
+        with ThreadPoolExecutor(max_workers = 1) as pool:
+            while True:
+                # The outer loop computes hitting sets with a heuristic.
+                heuristic = (skip == 0)
+                if heuristic:
+                    encoding    = pool.submit(encode_edges)
+                    hittingset  = compute_hs(heuristic=True)
+                    satisfiable = run_satsolver(satsolver, assumption(hittingset))
+                    encoding.result()
+                else:
+                    skip, satisfiable = skip - 1, True
+                if satisfiable:
+                    # If the formula is satisfiable under the assumption computed with the heuristic,
+                    # we compute hitting sets with the IPU.
+                    hittingset = compute_hs()
+                    if run_satsolver(satsolver, assumption(hittingset)):
+                        # The formula is also satisfiable under the assumptions computed with the IPU.
+                        # This is the best solution we can hope for and, hence, we terminate.
+                        # Note that we do *not* have necessarily reached an optimum unless we use an exact IPU.
+                        break
+                    if heuristic:
+                        streak += 1
+                        if patience > 0 and streak >= patience:
+                            streak, skip = 0, patience
+                    if not self._extract_core(satsolver):
+                        break
+                    elif self._repair_hittingset(satsolver, hittingset):
+                        # Fast path: The cheaply repaired hitting set of the IPU yields a solution.
+                        break
+                else:
+                    streak = 0
+                    if not self._extract_core(satsolver):
+                        break
 
         # Map the model back to the original problem.
         model = satsolver.get_model()
         if model:
-            assignment = model[:len(model)-len(relaxation_vars)]
-            cost = sum(map(
-                    lambda v: self.hypergraph.get_weight(self.mapping.get_value(v)),
-                    filter(lambda v: v not in model, relaxation_vars)
-                ))
-            fitness = sum(map(
-                lambda v: self.hypergraph.get_weight(self.mapping.get_value(v)),
-                relaxation_vars
-            )) - cost
+            assignment = model[:len(model)-len(self.relaxation)]
+            satisfied = np.array(model, dtype=np.int64)[self._relaxation_arr - 1] > 0 # model[v-1] is the literal of v
+            cost      = float(self.hypergraph.weights[~satisfied].sum())
+            fitness   = self._total_weight - cost
             return assignment, cost, fitness
         return None
-                
-
@@ -1,4 +1,5 @@
-import sys, time, yaml, argparse
+import sys, gc, time, yaml, argparse
+import numpy as np
 from pysat.formula import CNF
 from i2hs import Hypergraph, Solver
 
@@ -26,7 +27,7 @@ def arguments():
         description='A simple MaxSAT solver based on Implicit Ising Hitting Set.'
     )
     parser.add_argument('--version', action='version', version='%(prog)s {0}'.format(__version__))
-    parser.add_argument("-f", "--file", type=argparse.FileType("r"), default=sys.stdin, help="Input formula (as DIMACS2022 wcnf). Default is stdin.")
+    parser.add_argument("-f", "--file", type=argparse.FileType("rb"), default=sys.stdin.buffer, help="Input formula (as DIMACS2022 wcnf). Default is stdin.")
     parser.add_argument("-c", "--config", type=str, default="config.yaml", help="Path to the configuration file. Default is config.yaml.")
     return parser.parse_args()
             
@@ -66,30 +67,39 @@ if __name__ == "__main__":
     section("Parsing Input")
     tstart = time.time()    
     print(f"c Parsing the input formula ...", end = "", flush=True)
-    phi    = CNF()
-    free = 0; relaxation = []; buffer = [] 
-    for line in args.file:
-        line = line.strip()
-        if line.startswith(('c', 'p')):
-            continue # Skip comments and problem lines.
-
-        # Weight and clause. Update next free variable.
-        w, c = line.split(" ")[0], [int(x) for x in line.split(" ")[1:-1]]
-        free = max(free, max(map(lambda l: abs(l), c)))
-
-        # Hard clauses can be added directly, soft clauses
-        # are added later using relaxation variables.
-        if w == 'h':
-            phi.append(c)
+    gc.disable() # Millions of acyclic clause lists are created, collecting meanwhile only costs time.
+    weights = []; body = []
+    for line in args.file.read().split(b"\n"):
+        toks = line.split(None, 1)
+        if not toks or toks[0].startswith((b'c', b'p')):
+            continue # Skip empty lines, comments, and problem lines.
+        weights.append(toks[0]); body.append(toks[1])
+
+    # Tokenize all clauses at once. Clauses are terminated by a zero, which
+    # is no literal, and the next free variable follows from the largest literal.
+    literals = np.fromstring(b" ".join(body), dtype=np.int64, sep=" ")
+    ends     = np.flatnonzero(literals == 0)
+    starts   = np.concatenate(([0], ends[:-1] + 1))
+    free     = int(max(literals.max(), -literals.min())) if len(literals) > 0 else 0
+    literals = literals.tolist()
+
+    # Hard clauses can be added directly, soft clauses
+    # are added after them using relaxation variables.
+    hard = []; soft = []; relaxation = []
+    for (w, s, e) in zip(weights, starts.tolist(), ends.tolist()):
+        if w == b'h':
+            hard.append(literals[s:e])
         else:
-            assert( float(w) >= 0 )
-            buffer.append( (float(w),c) )
-
-    # Add the soft clauses using relaxation variables.
-    for (w,c) in buffer:
-        free += 1; c.append(-free)
-        phi.append(c)
-        relaxation.append( (free,w) )
+            w = float(w); assert( w >= 0 )
+            free += 1
+            soft.append(literals[s:e] + [-free])
+            relaxation.append( (free,w) )
+    hard.extend(soft)
+
+    # The number of variables is known, so the clauses are handed over as they are.
+    phi = CNF()
+    phi.clauses, phi.nv = hard, free
+    gc.freeze(); gc.enable() # The formula lives until the end, keep it out of later collections.
     print(f" {(time.time()-tstart):06.2f}s.\nc")
     print(f"c #Variables:   {free-len(relaxation)}")
     print(f"c #Clauses:     {len(phi.clauses)}")
@@ -110,13 +120,8 @@ if __name__ == "__main__":
         assignment, cost, fitness = result
         print(f"s SATISFIABLE")
         print(f"o {cost}")
-        for (i,l) in enumerate( assignment ):
-            if i % 25 == 0:
-                if i > 0:
-                    print()
-                print("v", end="")
-            print(f" {l}", end="")
-        print("\nc")
+        rows = [" ".join(map(str, assignment[i:i+25])) for i in range(0, len(assignment), 25)]
+        sys.stdout.write("".join(f"v {row}\n" for row in rows) + "c\n")
 
     section("Statistics")        
     print(f"c Solved the problem in   {(time.time()-tstart):06.2f}s")
@@ -125,8 +130,9 @@ if __name__ == "__main__":
     print(f"c --> Annealing Time:     {solver.hypergraph.annealingtime:06.2f}s")
     print(f"c --> #IPU Calls:         {solver.hypergraph.ipucalls}")
     print("c")
-    print(f"c Fitness:    {fitness}")
-    print(f"c Cost:       {cost}")
+    if result is not None:
+        print(f"c Fitness:    {fitness}")
+        print(f"c Cost:       {cost}")
     
 
     